@@ -1,9 +1,12 @@
 import os
-import re
 import io
+import asyncio
+import hashlib
 import logging
 import argparse
+import httpx
 import requests
+from requests.adapters import HTTPAdapter, Retry
 from graphviz import Digraph
 
 logging.basicConfig(
@@ -14,16 +17,27 @@ logger = logging.getLogger(__name__)
 
 os.makedirs('graph', exist_ok=True)
 
-LISTS_TO_IGNORE = ["Documents", "Liens de partage", "Extensions de modèle web", "User", "Web Template Extensions"]
-COLUMNS_TO_IGNORE = [
+LISTS_TO_IGNORE = frozenset({"Documents", "Liens de partage", "Extensions de modèle web", "User", "Web Template Extensions"})
+COLUMNS_TO_IGNORE = frozenset({
     "_ColorTag", "ComplianceAssetId", "_UIVersionString", "Attachments",
     "Edit", "LinkTitleNoMenu", "LinkTitle", "DocIcon", "ItemChildCount",
-    "FolderChildCount", "_ComplianceFlags", "_ComplianceTag", 
+    "FolderChildCount", "_ComplianceFlags", "_ComplianceTag",
     "_ComplianceTagWrittenTime", "_ComplianceTagUserId", "_IsRecord",
     "AppAuthor", "AppEditor", "ID", "ContentType"
-]
-COLUMN_PATTERN_TO_IGNORE = ".*x003a.*"
+})
+COLUMN_SUBSTRING_TO_IGNORE = "x003a"
 GRAPH_API_BASE_URL = "https://graph.microsoft.com/v1.0"
+BATCH_SIZE = 20  # Microsoft Graph $batch accepts at most 20 requests
+MAX_CONCURRENT_BATCHES = 8
+LISTS_SELECT = "$select=displayName,id"
+COLUMNS_SELECT = "$select=name,id,required,text,lookup,dateTime,number,choice,boolean,personOrGroup,calculated"
+
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=10,
+    pool_maxsize=20,
+    max_retries=Retry(total=3, backoff_factor=0.3, status_forcelist=[429, 500, 502, 503, 504])
+))
 
 def create_headers(token):
     return {
@@ -34,30 +48,29 @@ def create_headers(token):
 
 def fetch_data(url, headers):
     try:
-        response = requests.get(url, headers=headers)
+        response = _SESSION.get(url, headers=headers, timeout=30)
         response.raise_for_status()
         return response.json()
     except requests.exceptions.RequestException as e:
         logger.error(f"Request failed: {e}")
         return None
 
+def iter_pages(url, headers):
+    """Yield items from a paginated Graph response, following @odata.nextLink"""
+    while url:
+        data = fetch_data(url, headers)
+        if not data:
+            return
+        yield from data.get('value', [])
+        url = data.get('@odata.nextLink')
+
+_TYPE_KEYS = ("text", "lookup", "dateTime", "number", "choice", "boolean", "personOrGroup", "calculated")
+
 def get_column_type(column):
-    
-    type_mappings = {
-        "text": "text",
-        "lookup": "lookup",
-        "dateTime": "dateTime",
-        "number": "number",
-        "choice": "choice",
-        "boolean": "boolean",
-        "person": "person",
-        "calculated": "calculated",
-    }
-    
-    for key, value in type_mappings.items():
+    for key in _TYPE_KEYS:
         if key in column:
-            return {"type": value, "details": column[key]}
-    
+            return {"type": key, "details": column[key]}
+
     return {"type": "unknown", "details": {}}
 
 def fetch_sharepoint_lists(token, site_id):
@@ -65,97 +78,169 @@ def fetch_sharepoint_lists(token, site_id):
     endpoint = f"{GRAPH_API_BASE_URL}/sites/{site_id}/lists"
     headers = create_headers(token)
     
-    lists_data = fetch_data(endpoint, headers)
-    
-    if not lists_data or 'value' not in lists_data:
-        logger.error("Failed to fetch lists or no lists found.")
-        return {}, headers, endpoint
-    
     lists_dict = {}
-    for item in lists_data['value']:
+    for item in iter_pages(f"{endpoint}?{LISTS_SELECT}", headers):
         if isinstance(item, dict) and 'displayName' in item and 'id' in item:
             if item['displayName'] not in LISTS_TO_IGNORE:
                 lists_dict[item['displayName']] = item['id']
         else:
             logger.warning(f"Unexpected item format in 'value': {item}")
-    
-    return lists_dict, headers, endpoint
 
-def fetch_columns(list_id, endpoint, headers):
-    """Fetch  columns for a specific list"""
-    current_endpoint = f"{endpoint}/{list_id}/columns"
-    columns_data = fetch_data(current_endpoint, headers)
-    
-    if not columns_data or 'value' not in columns_data:
-        logger.error(f"Failed to fetch columns for list '{list_id}'")
-        return []
-    
+    if not lists_dict:
+        logger.error("Failed to fetch lists or no lists found.")
+
+    return lists_dict, endpoint
+
+def filter_columns(columns_values):
+    """Keep only relevant columns, skipping COLUMNS_TO_IGNORE and internal names"""
     columns = []
-    for col in columns_data['value']:
+    for col in columns_values:
         name = col.get("name", "")
-        if (name not in COLUMNS_TO_IGNORE and 
-            not re.match(COLUMN_PATTERN_TO_IGNORE, name)):
+        if (name not in COLUMNS_TO_IGNORE and
+            COLUMN_SUBSTRING_TO_IGNORE not in name):
             columns.append({
                 "name": name,
                 "id": col.get("id"),
                 "required": col.get("required", False),
                 "type_details": get_column_type(col)
             })
-    
+
     return columns
 
-def generate_uml_graph(lists_dict, endpoint, headers):
-    graph = Digraph(comment="Database Schema", format="png")
+def fetch_columns(list_id, endpoint, headers):
+    """Fetch  columns for a specific list"""
+    current_endpoint = f"{endpoint}/{list_id}/columns?{COLUMNS_SELECT}"
+    return filter_columns(iter_pages(current_endpoint, headers))
+
+async def fetch_batch_async(client, semaphore, payload):
+    """POST one $batch payload to Graph, bounded by the shared semaphore"""
+    async with semaphore:
+        try:
+            response = await client.post(f"{GRAPH_API_BASE_URL}/$batch", json=payload)
+            response.raise_for_status()
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"Batch request failed: {e}")
+            return None
+
+async def run_batch_requests(payloads, headers):
+    """Run all $batch POSTs concurrently over a single HTTP/2 connection"""
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+    async with httpx.AsyncClient(http2=True, timeout=60, headers=headers) as client:
+        tasks = [fetch_batch_async(client, semaphore, payload) for payload in payloads]
+        return await asyncio.gather(*tasks)
+
+def fetch_all_columns_batched(lists_dict, endpoint, headers):
+    """Fetch columns for all lists via $batch requests (BATCH_SIZE lists per call)"""
+    relative_endpoint = endpoint[len(GRAPH_API_BASE_URL):]
+    list_names = list(lists_dict)
+    columns_by_list = {}
+
+    chunks = [list_names[start:start + BATCH_SIZE]
+              for start in range(0, len(list_names), BATCH_SIZE)]
+    payloads = [
+        {
+            "requests": [
+                {
+                    "id": str(i),
+                    "method": "GET",
+                    "url": f"{relative_endpoint}/{lists_dict[name]}/columns?{COLUMNS_SELECT}"
+                }
+                for i, name in enumerate(chunk)
+            ]
+        }
+        for chunk in chunks
+    ]
+
+    batch_results = asyncio.run(run_batch_requests(payloads, headers))
+
+    for chunk, batch_data in zip(chunks, batch_results):
+        if batch_data is None:
+            for name in chunk:
+                columns_by_list[name] = []
+            continue
+
+        responses_by_id = {item.get("id"): item for item in batch_data.get("responses", [])}
+        for i, name in enumerate(chunk):
+            item = responses_by_id.get(str(i), {})
+            body = item.get("body") or {}
+            if item.get("status") != 200 or 'value' not in body:
+                logger.error(f"Failed to fetch columns for list '{name}'")
+                columns_by_list[name] = []
+            else:
+                values = list(body['value'])
+                next_link = body.get('@odata.nextLink')
+                if next_link:
+                    values.extend(iter_pages(next_link, headers))
+                columns_by_list[name] = filter_columns(values)
+
+    return columns_by_list
+
+_ROW_TMPL = "<TR><TD>{}</TD><TD>{}</TD></TR>".format
+
+def generate_uml_graph(lists_dict, endpoint, token, output_format="svg"):
+    headers = create_headers(token)
+    graph = Digraph(comment="Database Schema", format=output_format)
     graph.attr(rankdir="LR")
 
     relationships = []
-    
-    for list_name, list_id in lists_dict.items():
-        columns = fetch_columns(list_id, endpoint, headers)
+
+    columns_by_list = fetch_all_columns_batched(lists_dict, endpoint, headers)
+
+    for list_name, columns in columns_by_list.items():
         logger.info(f"Generating table for {list_name}")
         
-        label = f"<<TABLE BORDER='0' CELLBORDER='1' CELLSPACING='0'>\n"
-        label += f"<TR><TD COLSPAN='2'><B>{list_name}</B></TD></TR>\n"
-        
+        rows = "\n".join(_ROW_TMPL(column["name"], column["type_details"]["type"]) for column in columns)
+        label = (f"<<TABLE BORDER='0' CELLBORDER='1' CELLSPACING='0'>\n"
+                 f"<TR><TD COLSPAN='2'><B>{list_name}</B></TD></TR>\n"
+                 f"{rows}\n</TABLE>>")
+        graph.node(list_name, label=label, shape="plaintext")
+
         for column in columns:
-            column_name = column.get("name")
-            column_type = column.get("type_details", {}).get("type", "unknown")
-            label += f"<TR><TD>{column_name}</TD><TD>{column_type}</TD></TR>\n"
-            
-            if column_type == "lookup":
-                list_id_lookup = column.get("type_details", {}).get("details", {}).get("listId")
+            type_details = column["type_details"]
+            if type_details["type"] == "lookup":
+                list_id_lookup = type_details["details"].get("listId")
                 if list_id_lookup:
-                    relationships.append((list_name, list_id_lookup, column_name))
-        
-        label += "</TABLE>>"
-        graph.node(list_name, label=label, shape="plaintext")
+                    relationships.append((list_name, list_id_lookup, column["name"]))
 
+    id_to_name = {list_id: name for name, list_id in lists_dict.items()}
     for source_table, target_list_id, column_name in relationships:
-        target_table = next((name for name, id_ in lists_dict.items() if id_ == target_list_id), None)
+        target_table = id_to_name.get(target_list_id)
         if target_table:
             graph.edge(source_table, target_table, label=column_name)
 
     return graph.pipe()
 
-def main(token, site_id):
-    lists_dict, headers, endpoint = fetch_sharepoint_lists(token, site_id)
-    
+def main(token, site_id, output_format="svg"):
+    lists_dict, endpoint = fetch_sharepoint_lists(token, site_id)
+
     if not lists_dict:
         logger.error("No SharePoint lists found or authentication failed")
         return
-    
-    graph_data = generate_uml_graph(lists_dict, endpoint, headers)
-    
-    output_path = os.path.join("graph", "uml_graph.png")
-    with open(output_path, "wb") as f:
+
+    graph_data = generate_uml_graph(lists_dict, endpoint, token, output_format)
+
+    output_path = os.path.join("graph", f"uml_graph.{output_format}")
+    digest = hashlib.blake2b(graph_data, digest_size=8).hexdigest()
+
+    if os.path.exists(output_path):
+        with open(output_path, "rb") as f:
+            if hashlib.blake2b(f.read(), digest_size=8).hexdigest() == digest:
+                logger.info(f"✅ UML diagram unchanged, keeping {output_path}")
+                return
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as f:
         f.write(graph_data)
-    
+    os.replace(tmp_path, output_path)
+
     logger.info(f"✅ UML diagram saved to {output_path}")
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Generate UML diagram from SharePoint site")
     parser.add_argument("--token", required=True, help="Access token for Microsoft Graph API")
     parser.add_argument("--site-id", required=True, help="SharePoint site ID")
+    parser.add_argument("--format", choices=["svg", "png"], default="svg", help="Output image format (SVG renders much faster)")
     args = parser.parse_args()
 
-    main(args.token, args.site_id)
+    main(args.token, args.site_id, args.format)